@@ -3,9 +3,15 @@ import sys
 import zipfile
 import datetime
 from copy import copy
+from itertools import groupby
 
 from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
+from openpyxl.styles.cell_style import StyleArray
+
+# 合计行高亮（ARGB 需8位，"FFFF00" 会被补成 "00FFFF00"，alpha 为0）
+YELLOW_FILL = PatternFill("solid", fgColor="FFFFFF00")
 
 
 def assert_is_valid_xlsx(path: str):
@@ -17,10 +23,24 @@ def assert_is_valid_xlsx(path: str):
         raise ValueError(f"文件不是有效的 xlsx（不是zip结构）：{path}。可能是xls改名或文件损坏。")
 
 
+# 常见类型按 type 直接查表，免去逐个 isinstance
+_B_SORT_DISPATCH = {
+    type(None): lambda v: (1, 0, ""),
+    datetime.datetime: lambda v: (0, 0, v),
+    datetime.date: lambda v: (0, 1, v),
+    int: lambda v: (0, 2, v),
+    float: lambda v: (0, 2, v),
+    bool: lambda v: (0, 2, v),
+    str: lambda v: (0, 3, v),
+}
+
+
 def b_sort_key(v):
     """B列排序key：None最后；日期/时间；数值；字符串"""
-    if v is None:
-        return (1, 0, "")
+    fn = _B_SORT_DISPATCH.get(type(v))
+    if fn is not None:
+        return fn(v)
+    # 其它类型/子类走原来的判断
     if isinstance(v, datetime.datetime):
         return (0, 0, v)
     if isinstance(v, datetime.date):
@@ -30,71 +50,139 @@ def b_sort_key(v):
     return (0, 3, str(v))
 
 
+_COMMA_TBL = str.maketrans("", "", ",")
+
+
 def to_number(v):
     """把单元格值转成float（失败则0）"""
     if v is None:
         return 0.0
+    tv = type(v)  # 常见类型走 type 判断快速返回
+    if tv is float:
+        return v
+    if tv is int:
+        return float(v)
     if isinstance(v, (int, float)):
         return float(v)
     try:
-        s = str(v).replace(",", "").strip()
+        s = str(v).translate(_COMMA_TBL).strip()
         return float(s) if s else 0.0
     except Exception:
         return 0.0
 
 
-def row_is_empty(ws, rr, max_col):
-    for c in range(1, max_col + 1):
-        v = ws.cell(row=rr, column=c).value
-        if v is not None and not (isinstance(v, str) and v.strip() == ""):
-            return False
-    return True
+def snapshot_row(ws, r, max_col):
+    """
+    抓取整行：值 + 样式（用于整行移动/复写，保留边框粗细等）
+    按字段分列存放；样式对象直接引用源工作簿的样式表（不可变，无需 copy）
+    """
+    wb = ws.parent
+    cells = [ws.cell(row=r, column=c) for c in range(1, max_col + 1)]
+    styles = [cell._style or StyleArray() for cell in cells]
+    return {
+        "value": [cell.value for cell in cells],
+        "style": styles,
+        "font": [wb._fonts[st.fontId] for st in styles],
+        "fill": [wb._fills[st.fillId] for st in styles],
+        "border": [wb._borders[st.borderId] for st in styles],
+        "alignment": [wb._alignments[st.alignmentId] for st in styles],
+        "number_format": [cell.number_format for cell in cells],
+        "protection": [wb._protections[st.protectionId] for st in styles],
+        "comment": [cell.comment for cell in cells],
+    }
+
+
+def sum_row_template(ws, r, max_col, cache):
+    """
+    合计行模板：借用第 r 行的样式（保留边框），值清空、B~E 黄色
+    按整行样式指纹缓存，样式相同的行只抓取一次；返回的模板 value 列表是新的，可直接改
+    """
+    cells = [ws.cell(row=r, column=c) for c in range(1, max_col + 1)]
+    key = tuple(
+        (tuple(cell._style) if cell._style else None, id(cell.comment) if cell.comment else None)
+        for cell in cells
+    )
+    template = cache.get(key)
+    if template is None:
+        template = snapshot_row(ws, r, max_col)
+        for col in range(2, min(5, max_col) + 1):
+            template["fill"][col - 1] = YELLOW_FILL
+        cache[key] = template
+    return {**template, "value": [None] * max_col}
 
 
-def snapshot_row(ws, r, max_col):
-    """抓取整行：值 + 样式（用于整行移动/复写，保留边框粗细等）"""
-    snap = []
-    for c in range(1, max_col + 1):
-        cell = ws.cell(row=r, column=c)
-        snap.append({
-            "value": cell.value,
-            "style": copy(cell._style),
-            "font": copy(cell.font),
-            "fill": copy(cell.fill),
-            "border": copy(cell.border),
-            "alignment": copy(cell.alignment),
-            "number_format": cell.number_format,
-            "protection": copy(cell.protection),
-            "comment": cell.comment,
-        })
-    return snap
-
-
-def write_snapshot_row(ws, r, snap):
-    for c, d in enumerate(snap, start=1):
-        cell = ws.cell(row=r, column=c)
-        cell.value = d["value"]
-        cell._style = copy(d["style"])
-        cell.font = copy(d["font"])
-        cell.fill = copy(d["fill"])
-        cell.border = copy(d["border"])
-        cell.alignment = copy(d["alignment"])
-        cell.number_format = d["number_format"]
-        cell.protection = copy(d["protection"])
-        cell.comment = d["comment"]
-
-
-def copy_dimensions(src_ws, dst_ws):
+def split_a_blocks(rows_v, start_row, last):
+    """按A列连续相同值切块：返回 [(a_val, 起始行, 结束行)]，行号从1开始"""
+    blocks = []
+    r = start_row
+    for a_val, grp in groupby(row[0] for row in rows_v[start_row - 1:last]):
+        n = sum(1 for _ in grp)
+        blocks.append((a_val, r, r + n - 1))
+        r += n
+    return blocks
+
+
+def write_snapshot_row(ws, snap, style_cache):
+    """
+    write-only 模式：按行追加（行高需在追加前设置）
+    style_cache：同一组样式只在首次出现时登记到输出工作簿，之后复用其 StyleArray
+    已知无样式（缓存命中）且无批注的单元格直接追加原值，不再构造 WriteOnlyCell
+    注意：openpyxl 只在有样式的单元格之后换新对象，无样式的 WriteOnlyCell（仅带批注）
+    会被它复用来装后面的原值，所以本行出现这种单元格后，其余单元格一律传 WriteOnlyCell
+    """
+    row = []
+    raw_ok = True
+    for value, style, font, fill, border, alignment, number_format, protection, comment in zip(
+        snap["value"], snap["style"], snap["font"], snap["fill"], snap["border"],
+        snap["alignment"], snap["number_format"], snap["protection"], snap["comment"],
+    ):
+        # 样式对象来自源工作簿样式表或模块常量，整个处理期间存活，可按 id 作 key
+        key = (tuple(style), id(font), id(fill), id(border), id(alignment), number_format, id(protection))
+        out_style = style_cache.get(key)
+        if raw_ok and comment is None and out_style is not None and not any(out_style):
+            row.append(value)
+            continue
+        cell = WriteOnlyCell(ws, value=value)
+        if out_style is None:
+            cell._style = copy(style)  # 下面的赋值会改写 _style，这里必须复制
+            cell.font = font
+            cell.fill = fill
+            cell.border = border
+            cell.alignment = alignment
+            cell.number_format = number_format
+            cell.protection = protection
+            style_cache[key] = cell._style
+        else:
+            cell._style = out_style  # 缓存的 StyleArray 之后不再改动，多个单元格共享
+        cell.comment = comment
+        if cell.has_style:
+            row.append(cell)
+        elif comment is not None or not raw_ok:
+            row.append(cell)
+            raw_ok = False
+        else:
+            row.append(value)
+    ws.append(row)
+
+
+def copy_sheet_layout(src_ws, dst_ws):
+    """
+    列宽 + 合并单元格一次性复制（write-only 模式下列宽必须在追加第一行前设置）
+    行高只能随行追加前逐行设置，见 copy_row_dim
+    """
     for col_letter, dim in src_ws.column_dimensions.items():
-        dst_ws.column_dimensions[col_letter].width = dim.width
-        dst_ws.column_dimensions[col_letter].hidden = dim.hidden
-        dst_ws.column_dimensions[col_letter].outlineLevel = dim.outlineLevel
-        dst_ws.column_dimensions[col_letter].collapsed = dim.collapsed
+        dd = dst_ws.column_dimensions[col_letter]
+        dd.width = dim.width
+        dd.hidden = dim.hidden
+        dd.outlineLevel = dim.outlineLevel
+        dd.collapsed = dim.collapsed
+    for merged in src_ws.merged_cells.ranges:
+        dst_ws.merged_cells.add(str(merged))
 
 
 def copy_row_dim(src_ws, dst_ws, src_r, dst_r):
-    if src_r in src_ws.row_dimensions:
-        sd = src_ws.row_dimensions[src_r]
+    sd = src_ws.row_dimensions.get(src_r)  # get 不会触发默认值创建
+    if sd is not None:
         dd = dst_ws.row_dimensions[dst_r]
         dd.height = sd.height
         dd.hidden = sd.hidden
@@ -102,13 +190,11 @@ def copy_row_dim(src_ws, dst_ws, src_r, dst_r):
         dd.collapsed = sd.collapsed
 
 
-def fixed_e_value(c_val, d_val, e_val):
+def fixed_e_value(c_num, d_num, e_val):
     """
     修复E列：如果E为空/0，但C和D有值，则用 E=C*D（保留两位小数）
+    c_num/d_num 为调用方已用 to_number 解析好的数值（每行只解析一次）
     """
-    c_num = to_number(c_val)
-    d_num = to_number(d_val)
-
     if c_num != 0 and d_num != 0:
         if e_val is None:
             return round(c_num * d_num, 2)
@@ -120,6 +206,40 @@ def fixed_e_value(c_val, d_val, e_val):
     return e_val
 
 
+def process_block(rows):
+    """
+    单个A区块的计算（纯函数，只读写普通元组/列表，不碰工作簿）：
+    修复E、按B排序、C/E合计
+    rows：区块内各行的显示值元组
+    返回 (排序后的行下标, 修复后的E列值, C合计, E合计)
+    """
+    keys = []
+    c_nums = []  # C/E 数值列：每行只解析一次，合计直接求和
+    e_nums = []
+    e_fixed = []
+    # 同一工作表各行宽度相同（均为 max_col），列数判断提到循环外
+    if rows and len(rows[0]) >= 5:
+        # 常见的 A~E 五列表：固定下标，无分支
+        for row in rows:
+            keys.append(b_sort_key(row[1]))
+            c_num = to_number(row[2])
+            c_nums.append(c_num)
+            e_val = fixed_e_value(c_num, to_number(row[3]), row[4])
+            e_fixed.append(e_val)
+            e_nums.append(to_number(e_val))
+    else:
+        # 不足5列：没有E列可修复
+        n = len(rows[0]) if rows else 0
+        for row in rows:
+            keys.append(b_sort_key(row[1] if n >= 2 else None))
+            if n >= 3:
+                c_nums.append(to_number(row[2]))
+
+    # key 已算好，这里只排下标；sorted 稳定
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return order, e_fixed, sum(c_nums, 0.0), sum(e_nums, 0.0)
+
+
 def process_excel_xlsx_no_header(input_path: str, output_path: str):
     """
     无表头版：
@@ -131,124 +251,84 @@ def process_excel_xlsx_no_header(input_path: str, output_path: str):
     """
     assert_is_valid_xlsx(input_path)
 
-    wb_formula = load_workbook(input_path, data_only=False)
-    wb_values = load_workbook(input_path, data_only=True)
-    ws_f = wb_formula.active
-    ws_v = wb_values.active
+    # 只加载一次：data_only 下样式/行高/合并单元格照样可用，公式原文本脚本也不会写出
+    # 输出是新建的工作簿，外部链接部件用不上，不加载
+    wb_src = load_workbook(input_path, data_only=True, keep_links=False)
+    ws_src = wb_src.active
 
-    max_col = ws_f.max_column
-    yellow_fill = PatternFill("solid", fgColor="FFFF00")
+    max_col = ws_src.max_column
+    has_c = max_col >= 3  # 列数判断与行无关，提前算好
+    has_e = max_col >= 5
 
     start_row = 1  # ✅ 无表头：第一行就是数据
 
-    last = ws_f.max_row
-    while last >= start_row and row_is_empty(ws_f, last, max_col):
-        last -= 1
+    # 一次取出全部显示值（values_only 不创建单元格对象），再找最后一个非空行
+    rows_v = list(ws_src.iter_rows(min_row=1, max_col=max_col, values_only=True))
+    last = start_row - 1
+    for i in range(start_row, len(rows_v) + 1):
+        if any(v is not None and not (isinstance(v, str) and v.strip() == "") for v in rows_v[i - 1]):
+            last = i
 
-    out_wb = Workbook()
-    out_ws = out_wb.active
-    out_ws.title = ws_f.title
-    copy_dimensions(ws_f, out_ws)
+    out_wb = Workbook(write_only=True)
+    out_ws = out_wb.create_sheet(ws_src.title)
+    copy_sheet_layout(ws_src, out_ws)
+    style_cache = {}
+    template_cache = {}
 
     out_r = 1
-    r = start_row
-    
+
     grand_sum_c = 0.0
     grand_sum_e = 0.0
 
-    while r <= last:
-        a_val = ws_f.cell(row=r, column=1).value
-
+    # A连续区块（块边界一次算好）
+    for a_val, start, end in split_a_blocks(rows_v, start_row, last):
         # 空行原样复制
         if a_val is None or (isinstance(a_val, str) and a_val.strip() == ""):
-            snap = snapshot_row(ws_f, r, max_col)
-            for c in range(1, max_col + 1):
-                v_disp = ws_v.cell(row=r, column=c).value
-                if v_disp is not None:
-                    snap[c - 1]["value"] = v_disp
-            write_snapshot_row(out_ws, out_r, snap)
-            copy_row_dim(ws_f, out_ws, r, out_r)
-            out_r += 1
-            r += 1
+            for rr in range(start, end + 1):
+                snap = snapshot_row(ws_src, rr, max_col)
+                copy_row_dim(ws_src, out_ws, rr, out_r)
+                write_snapshot_row(out_ws, snap, style_cache)
+                out_r += 1
             continue
 
-        # A连续区块
-        start = r
-        end = r
-        while end + 1 <= last and ws_f.cell(row=end + 1, column=1).value == a_val:
-            end += 1
+        # ✅ 先“出结果”：修复E + 排序 + 合计（只用显示值）
+        order, e_fixed, sum_c, sum_e = process_block(rows_v[start - 1:end])
 
-        # 取区块并修复E
-        block = []
-        for rr in range(start, end + 1):
-            snap = snapshot_row(ws_f, rr, max_col)
-
-            # 用显示值覆盖（避免把公式文本写出去）
-            for c in range(1, max_col + 1):
-                v_disp = ws_v.cell(row=rr, column=c).value
-                if v_disp is not None:
-                    snap[c - 1]["value"] = v_disp
-
-            if max_col >= 5:
-                snap[4]["value"] = fixed_e_value(snap[2]["value"], snap[3]["value"], snap[4]["value"])
-
-            block.append(snap)
-
-        # ✅ 先“出结果”：排序
-        block_sorted = sorted(block, key=lambda s: b_sort_key(s[1]["value"] if len(s) >= 2 else None))
-
-        # ✅ 再写结果
-        for i, snap in enumerate(block_sorted):
-            write_snapshot_row(out_ws, out_r, snap)
-            copy_row_dim(ws_f, out_ws, start + i, out_r)
+        # ✅ 再写结果：按排序后的顺序逐行抓取样式并写出
+        for i, k in enumerate(order):
+            snap = snapshot_row(ws_src, start + k, max_col)
+            if has_e:
+                snap["value"][4] = e_fixed[k]
+            copy_row_dim(ws_src, out_ws, start + i, out_r)
+            write_snapshot_row(out_ws, snap, style_cache)
             out_r += 1
 
-        # ✅ 基于最终结果计算合计
-        sum_c = sum(to_number(s[2]["value"]) for s in block_sorted) if max_col >= 3 else 0.0
-        sum_e = sum(to_number(s[4]["value"]) for s in block_sorted) if max_col >= 5 else 0.0
-
         grand_sum_c += sum_c
         grand_sum_e += sum_e
 
-        template = snapshot_row(ws_f, end, max_col)
-        for c in range(max_col):
-            template[c]["value"] = None
-        if max_col >= 3:
-            template[2]["value"] = sum_c
-        if max_col >= 5:
-            template[4]["value"] = round(sum_e, 2)
-
-        # B~E 黄色
-        for col in range(2, min(5, max_col) + 1):
-            template[col - 1]["fill"] = copy(yellow_fill)
+        template = sum_row_template(ws_src, end, max_col, template_cache)  # B~E 黄色
+        if has_c:
+            template["value"][2] = sum_c
+        if has_e:
+            template["value"][4] = round(sum_e, 2)
 
-        write_snapshot_row(out_ws, out_r, template)
-        copy_row_dim(ws_f, out_ws, end, out_r)
+        copy_row_dim(ws_src, out_ws, end, out_r)
+        write_snapshot_row(out_ws, template, style_cache)
         out_r += 1
 
-        r = end + 1
-
-    for merged in ws_f.merged_cells.ranges:
-        out_ws.merge_cells(str(merged))
     # ====== 最后追加总合计行（全表，不区分类）======
-    template_total = snapshot_row(ws_f, last, max_col)  # 用最后一行当模板保留边框
-    for c in range(max_col):
-        template_total[c]["value"] = None
+    template_total = sum_row_template(ws_src, last, max_col, template_cache)  # 用最后一行当模板保留边框
 
     # 建议A列写“总合计”，否则筛选A非空时会看不到
-    template_total[0]["value"] = "合计"
-
-    if max_col >= 3:
-        template_total[2]["value"] = grand_sum_c
-    if max_col >= 5:
-        template_total[4]["value"] = round(grand_sum_e, 2)
+    template_total["value"][0] = "合计"
 
-    # 你想高亮的话：B~E黄色（和小计一致）
-    for col in range(2, min(5, max_col) + 1):
-        template_total[col - 1]["fill"] = copy(yellow_fill)
+    if has_c:
+        template_total["value"][2] = grand_sum_c
+    if has_e:
+        template_total["value"][4] = round(grand_sum_e, 2)
 
-    write_snapshot_row(out_ws, out_r, template_total)
-    copy_row_dim(ws_f, out_ws, last, out_r)
+    copy_row_dim(ws_src, out_ws, last, out_r)
+    write_snapshot_row(out_ws, template_total, style_cache)
     out_r += 1
 
     os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)